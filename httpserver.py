@@ -1,180 +1,331 @@
-from flask import Flask, request
-from influxdb import InfluxDBClient
+"""
+Webhook receiver that forwards device data into InfluxDB.
 
-import struct, base64, json
+The app is async (Quart) and writes to InfluxDB's HTTP API with httpx, so a
+handler never blocks a worker while the database is slow. Run it under
+hypercorn with uvloop:
 
-app = Flask(__name__)
-#client = InfluxDBClient(host='data.yoerik.com', port=8086)
-client = InfluxDBClient(host='10.10.1.20', port=8086)
-#client = InfluxDBClient(host='mydomain.com', port=8086, username='myuser', password='mypass' ssl=True, verify_ssl=True)
+    hypercorn -k uvloop --workers 2 --bind 0.0.0.0:5000 httpserver:app
 
-print(client.get_list_database())
+Running `python httpserver.py` starts the same command from this file's
+directory. Dependencies are listed in requirements-server.txt.
+"""
 
-client.create_database('hydroponics')
-client.switch_database('hydroponics')
+from quart import Quart, Response, request
+from quart.json.provider import JSONProvider
+import httpx
+import orjson
 
-def record_data(rawdata):
-    data = {}
+import struct, os, socket
+from binascii import a2b_base64
+import logging
+import asyncio
+
+class ORJSONProvider(JSONProvider):
+    """Parse request bodies and encode responses with orjson instead of stdlib json."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+app = Quart(__name__)
+app.json = ORJSONProvider(app)
+
+#INFLUX_URL = 'http://data.yoerik.com:8086'
+INFLUX_URL = 'http://10.10.1.20:8086'
+#INFLUX_URL = 'https://mydomain.com:8086'  # with auth=('myuser', 'mypass') on the client
+
+# Every endpoint answers with the same body; build the response once and
+# return the shared object instead of a new one per request.
+_SUCCESS = Response(b'Success', 200, mimetype='text/plain')
+
+# Opened in start_influx(). The database is a query parameter on each /write,
+# so one pooled client serves all of them.
+influx = None
+writer = None
+
+# Points are sent as InfluxDB line protocol, the format the server ingests natively.
+_MEASUREMENT_ESCAPE = str.maketrans({',': r'\,', ' ': r'\ ', '\n': r'\n'})
+_KEY_ESCAPE = str.maketrans({',': r'\,', '=': r'\=', ' ': r'\ ', '\n': r'\n'})
+
+def _field_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return f'{value}i'
+    if isinstance(value, float):
+        return repr(value)
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{value}"'
+
+def _tag(key, value):
+    """',key=value' for one tag, or '' if the value is empty (empty tags are invalid)."""
+    if value is None or value == '':
+        return ''
+    return f",{str(key).translate(_KEY_ESCAPE)}={str(value).translate(_KEY_ESCAPE)}"
+
+def _series(measurement, tags):
+    """Measurement plus tag set, the part of a line shared by every point in a series."""
+    return str(measurement).translate(_MEASUREMENT_ESCAPE) + ''.join(
+        _tag(key, value) for key, value in sorted(tags.items()))
+
+def _field_set(fields):
+    return ','.join(f"{str(key).translate(_KEY_ESCAPE)}={_field_value(value)}"
+                    for key, value in fields.items() if value is not None)
+
+def to_line(measurement, tags, fields, ts=None):
+    """
+    Format a single point as an InfluxDB line protocol string.
+
+    Tags with empty values and fields set to None are dropped, as influxdb-python's make_lines does.
+    """
+    line = f'{_series(measurement, tags)} {_field_set(fields)}'
+    if ts is not None:
+        line += f' {int(ts)}'
+    return line
+
+# Points are queued by the request handlers and written to InfluxDB in batches
+# by a background task, so webhooks don't wait on the database round-trip.
+WRITE_BATCH_SIZE = 100      # flush once this many points are queued
+WRITE_FLUSH_INTERVAL = 1.0  # or after this many seconds, whichever comes first
+WRITE_MAX_POINTS = 5000     # upper bound on points per /write request
+WRITE_SHUTDOWN_TIMEOUT = 30.0  # how long shutdown waits for the final flush
+
+write_queue = asyncio.Queue(maxsize=10000)
+
+async def write_lines(db, lines):
+    for start in range(0, len(lines), WRITE_MAX_POINTS):
+        chunk = lines[start:start + WRITE_MAX_POINTS]
+        try:
+            response = await influx.post('/write', params={'db': db},
+                                         content=('\n'.join(chunk) + '\n').encode())
+            response.raise_for_status()
+        except Exception as e:
+            logger.error('Failed to write %d points to %s: %s', len(chunk), db, e)
+
+async def write_loop():
+    """
+    Drain write_queue in batches until it yields None, which stop_influx()
+    enqueues after the last request; everything queued before it is written.
+    """
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        try:
+            item = await write_queue.get()
+            if item is None:
+                break
+            db, points = item
+
+            batches = {db: list(points)}
+            count = len(points)
+            deadline = loop.time() + WRITE_FLUSH_INTERVAL
+            while count < WRITE_BATCH_SIZE:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(write_queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                db, points = item
+                batches.setdefault(db, []).extend(points)
+                count += len(points)
+
+            await asyncio.gather(*(write_lines(db, points) for db, points in batches.items()))
+        except Exception:
+            logger.exception('InfluxDB writer error')
+
+# Non-critical, high-volume series (1-wire temperatures) go to InfluxDB's UDP
+# listener instead: one sendto() per request, no connection and no ack. The
+# listener must be configured with database = "room_log" in its [[udp]] section
+# (see "Webhook Server" in README.md); without it these samples are lost.
+INFLUX_UDP_ADDR = ('10.10.1.20', 8089)
+UDP_MAX_PAYLOAD = 1400  # keep datagrams within one Ethernet frame
+
+udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+udp_sock.setblocking(False)
+
+def send_udp(lines):
+    """Fire-and-forget lines to the UDP listener; drops (and logs) on failure."""
+    datagram = b''
+    for line in lines:
+        encoded = line.encode() + b'\n'
+        if datagram and len(datagram) + len(encoded) > UDP_MAX_PAYLOAD:
+            _sendto(datagram)
+            datagram = b''
+        datagram += encoded
+    if datagram:
+        _sendto(datagram)
+
+def _sendto(datagram):
     try:
-        datasplit = rawdata['data'].split(', ')
-        datasplit = [d.split(':') for d in datasplit]
-
-        for i in datasplit:
-            data[i[0]] = float(i[1])
-    except (ValueError, IndexError):
-        data['raw'] = rawdata
-    json_body = [
-        {
-            "measurement": rawdata['event'],
-            "tags": {'coreid':rawdata['coreid']},
-            "fields": data
-        }
-    ]
-    client.switch_database('hydroponics')
-    client.write_points(json_body)
+        udp_sock.sendto(datagram, INFLUX_UDP_ADDR)
+    except OSError as e:
+        logger.warning('Dropped %d byte UDP write: %s', len(datagram), e)
+
+@app.before_serving
+async def start_influx():
+    global influx, writer
+    influx = httpx.AsyncClient(base_url=INFLUX_URL, timeout=10.0,
+                               limits=httpx.Limits(max_connections=64,
+                                                   max_keepalive_connections=16))
 
-def record_data_particle_json(rawdata):
+    response = await influx.get('/query', params={'q': 'SHOW DATABASES'})
+    logger.info('InfluxDB databases: %s', response.text)
+    await influx.post('/query', params={'q': 'CREATE DATABASE hydroponics'})
+
+    writer = asyncio.create_task(write_loop())
+    # UDP gives no errors, so a missing listener only shows up as missing data
+    logger.info('1-wire temperatures go to the InfluxDB UDP listener at %s:%d '
+                '(needs a [[udp]] section with database = "room_log")', *INFLUX_UDP_ADDR)
+
+@app.after_serving
+async def stop_influx():
+    # Requests are already answered, so flush what they queued before closing
+    await write_queue.put(None)
+    try:
+        await asyncio.wait_for(writer, WRITE_SHUTDOWN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.error('Gave up flushing InfluxDB writes after %.0fs; %d batches still queued',
+                     WRITE_SHUTDOWN_TIMEOUT, write_queue.qsize())
+    await influx.aclose()
+
+async def record_data(rawdata):
+    # "key:value, key:value" pairs in the Particle 'data' field, parsed in a
+    # single pass. Keys may contain spaces and float() tolerates whitespace
+    # around values; anything after a second ':' in an item is ignored.
+    # An item without ':' or with a non-numeric value (e.g. "status:ok")
+    # means the payload is stored raw.
+    try:
+        data = {key: float(value)
+                for key, value, *_ in (item.split(':') for item in rawdata['data'].split(', '))}
+    except ValueError:
+        data = {'raw': rawdata}
+    await write_queue.put(('hydroponics', [to_line(rawdata['event'], {'coreid':rawdata['coreid']}, data)]))
+
+async def record_data_particle_json(rawdata):
     data = {}
-    print(rawdata)
-    data = json.loads(rawdata['data'])
-    print('parsed data:', data)
-    json_body = [
-        {
-            "measurement": rawdata['event'],
-            "tags": {'coreid':rawdata['coreid']},
-            "fields": data
-        }
-    ]
-    client.switch_database('hydroponics')
-    client.write_points(json_body)
+    logger.debug('particle json: %s', rawdata)
+    data = orjson.loads(rawdata['data'])
+    logger.debug('parsed data: %s', data)
+    await write_queue.put(('hydroponics', [to_line(rawdata['event'], {'coreid':rawdata['coreid']}, data)]))
 
 @app.route('/loratag', methods=['GET', 'POST'])
-def process_loratag():
-    data = request.json
-    print(data)
+async def process_loratag():
+    data = await request.get_json()
+    logger.debug('loratag: %s', data)
     content = data['payload_fields']
     gateway = data['metadata']['gateways'][0]
     content['rssi'] = int(gateway['rssi'])
     content['snr'] = float(gateway['snr'])
     content['latitude'] = float(content.get('latitude',0.0))
     content['longitude'] = float(content.get('longitude',0.0))
-    json_body = [
-        {
-            "measurement": 'loratag',
-            "tags": {'delivery_method':'http'},
-            "fields": content
-        }
-    ]
-    client.switch_database('lora_log')
-    client.write_points(json_body)
+    await write_queue.put(('lora_log', [to_line('loratag', {'delivery_method':'http'}, content)]))
 
-    return 'Success'
+    return _SUCCESS
 
 @app.route('/heliumtag', methods=['GET', 'POST'])
-def process_heliumtag():
-    data = request.json
-    print(data)
+async def process_heliumtag():
+    data = await request.get_json()
+    logger.debug('heliumtag: %s', data)
     content = data['decoded']['payload']
-    json_body = [
-        {
-            "measurement": 'loratag',
-            "tags": {'delivery_method':'http'},
-            "fields": content
-        }
-    ]
-    client.switch_database('lora_log')
-    client.write_points(json_body)
+    await write_queue.put(('lora_log', [to_line('loratag', {'delivery_method':'http'}, content)]))
 
-    return 'Success'
+    return _SUCCESS
+
+# Helium tracker payload: lat, lon (float32), alt, vbat (int32), little-endian
+_HELIUM_STRUCT = struct.Struct('<ffii')
+# The 16-byte payload is 24 base64 characters once padded. It is decoded from a
+# fixed buffer pre-filled with '='; handlers run on one event loop and nothing
+# awaits between filling and decoding it, so a single module buffer is safe.
+_HELIUM_B64_LEN = 24
+_HELIUM_PADDING = memoryview(b'=' * _HELIUM_B64_LEN)
+_helium_buf = bytearray(_HELIUM_B64_LEN)
 
 @app.route('/helium', methods=['GET', 'POST'])
-def process_helium():
-    content = request.json
-    print(content)
+async def process_helium():
+    content = await request.get_json()
+    logger.debug('helium: %s', content)
 
 
-    s = struct.Struct('f f i i')
     text = content['payload']
-    missing_padding = len(text) % 4
-    if missing_padding:
-        text += b'='* (4 - missing_padding)
-
-    lat, lon, alt, vbat = s.unpack(base64.b64decode(text))
-    json_body = [
-        {
-            "measurement": content['dev_eui'],
-            "tags": {'delivery_method':'http'},
-            "fields": {'rssi':      content['hotspots'][0]['rssi'],
-                       'snr':       content['hotspots'][0]['snr'],
-                       'spreading': content['hotspots'][0]['spreading'],
-                       'channel':   content['hotspots'][0]['channel'],
-                       'name':      content['hotspots'][0]['name'],
-                       'frequency': content['hotspots'][0]['frequency'],
-                       'payload':   content['payload'],
-                       'lat': lat,
-                       'lon': lon,
-                       'vbat': vbat
-                       }
-        }
-    ]
-    client.switch_database('lora_log')
-    client.write_points(json_body)
-    return 'Success'
+    text = text.encode() if isinstance(text, str) else text
+    n = min(len(text), _HELIUM_B64_LEN)
+    _helium_buf[:n] = memoryview(text)[:n]
+    _helium_buf[n:] = _HELIUM_PADDING[n:]
+    lat, lon, alt, vbat = _HELIUM_STRUCT.unpack_from(a2b_base64(_helium_buf))
+    line = to_line(content['dev_eui'], {'delivery_method':'http'},
+                   {'rssi':      content['hotspots'][0]['rssi'],
+                    'snr':       content['hotspots'][0]['snr'],
+                    'spreading': content['hotspots'][0]['spreading'],
+                    'channel':   content['hotspots'][0]['channel'],
+                    'name':      content['hotspots'][0]['name'],
+                    'frequency': content['hotspots'][0]['frequency'],
+                    'payload':   content['payload'],
+                    'lat': lat,
+                    'lon': lon,
+                    'vbat': vbat
+                    })
+    await write_queue.put(('lora_log', [line]))
+    return _SUCCESS
 
 @app.route('/data', methods=['GET', 'POST'])
-def process_data():
-    content = request.json
-    record_data(content)
-    print(content)
-    return 'Success'
+async def process_data():
+    content = await request.get_json()
+    await record_data(content)
+    logger.debug('data: %s', content)
+    return _SUCCESS
 
 @app.route('/jsonlog', methods=['GET', 'POST'])
-def process_data_json():
-    content = json.loads(request.json['data'])
-    json_body = [
-        {
-            "measurement": content.pop('measurement'),
-            "tags": {'delivery_method':'http', 'coreid':request.json['coreid']},
-            "fields": content
-        }
-    ]
-    client.switch_database('room_log')
-    client.write_points(json_body)
+async def process_data_json():
+    body = await request.get_json()
+    content = orjson.loads(body['data'])
+    line = to_line(content.pop('measurement'),
+                   {'delivery_method':'http', 'coreid':body['coreid']},
+                   content)
+    await write_queue.put(('room_log', [line]))
 
-    return 'Success'
+    return _SUCCESS
 
 def process_log_point(point_data):
     """
-    Process a single data point and return formatted InfluxDB point structure.
+    Process a single data point and return it as an InfluxDB line protocol string.
     
     Args:
         point_data: Dictionary with 'measurement', optional 'tags', and 'fields' or remaining data as fields
     
     Returns:
-        Dictionary formatted for InfluxDB write_points
+        Line protocol string for the InfluxDB /write endpoint
     """
     point_copy = point_data.copy() if isinstance(point_data, dict) else {}
     
     measurement = point_copy.pop('measurement')
     
     tags = {'delivery_method':'http'}
-    if point_copy.get('tags'):
-        tags |= point_copy.pop('tags')
+    extra_tags = point_copy.pop('tags', None)
+    if extra_tags:
+        tags.update(extra_tags)
     
     if point_copy.get('fields'):
         fields = point_copy.pop('fields')
     else:
         fields = point_copy
     
-    return {
-        "measurement": measurement,
-        "tags": tags,
-        "fields": fields
-    }
+    return to_line(measurement, tags, fields)
 
 @app.route('/logtemperatures', methods=['GET', 'POST'])
-def process_temperatures():
-    content = request.json
+async def process_temperatures():
+    content = await request.get_json()
     #print(content)
 
 
@@ -191,51 +342,64 @@ def process_temperatures():
     }
     """
 
-    measurement = content['measurement']
-    tags = {'delivery_method':'http'} | content.get('tags', {})
+    tags = {'delivery_method':'http'}
+    extra_tags = content.get('tags')
+    if extra_tags:
+        tags.update(extra_tags)
+    # The per-sensor tag replaces any 'sensor' sent in the request tags
+    tags.pop('sensor', None)
     arduino_millis = content['arduino_millis']
     sensors = content['values']
 
+    # Every sensor shares the measurement, request tags and arduino_millis;
+    # format them once and only append the per-sensor tag and temperature.
+    series = _series(content['measurement'], tags)
+    millis = '' if arduino_millis is None else f'arduino_millis={_field_value(arduino_millis)}'
     write_points = []
     for sensor, value in sensors.items():
-        write_points.append({
-            "measurement": measurement,
-            "tags": tags | {'sensor': sensor},
-            "fields": {
-                "arduino_millis": arduino_millis,
-                "temperature": value
-            }
-        })
+        if value is None:
+            fields = millis
+        elif millis:
+            fields = f'{millis},temperature={_field_value(value)}'
+        else:
+            fields = f'temperature={_field_value(value)}'
+        if fields:
+            write_points.append(f'{series}{_tag("sensor", sensor)} {fields}')
 
 
-    client.switch_database('room_log')
-    client.write_points(write_points)
-    print(write_points)
-    return 'Success'
+    send_udp(write_points)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('temperatures: %s', write_points)
+    return _SUCCESS
 
 @app.route('/log', methods=['GET', 'POST'])
-def process_url():
-    content = request.json
+async def process_url():
+    content = await request.get_json()
     # Handle nested payload format (only if content is a dict)
-    if isinstance(content, dict) and content.get('decoded', {}).get('payload'):
-        content = content['decoded']['payload']
+    if type(content) is dict:
+        decoded = content.get('decoded')
+        if decoded:
+            payload = decoded.get('payload')
+            if payload:
+                content = payload
 
     # Check if this is a multi-point format (array of data points)
     if isinstance(content, list):
         # Multi-point format: array of objects
-        json_body = [process_log_point(point) for point in content]
+        lines = [process_log_point(point) for point in content]
     else:
         # Single-point format: single object
-        json_body = [process_log_point(content)]
+        lines = [process_log_point(content)]
     
-    print('-'*30)
-    print(request.data)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('log request: %s', await request.get_data())
+        logger.debug('log points: %s', lines)
 
-    print(json_body)
-    client.switch_database('room_log')
-    client.write_points(json_body)
-    print(json_body)
-    return 'Success'
+    await write_queue.put(('room_log', lines))
+    return _SUCCESS
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0')
\ No newline at end of file
+    # hypercorn imports 'httpserver' from its working directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    os.execvp('hypercorn', ['hypercorn', '-k', 'uvloop', '--workers', '2',
+                            '--bind', '0.0.0.0:5000', 'httpserver:app'])
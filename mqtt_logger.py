@@ -14,9 +14,9 @@ Default values:
     - Topic: testboard3/logs (device logs topic)
 """
 
+import codecs
 import sys
 import time
-from datetime import datetime
 import paho.mqtt.client as mqtt
 
 # Default MQTT settings
@@ -53,12 +53,17 @@ class MQTTLogger:
 
     def on_message(self, client, userdata, msg):
         """Called when a message is received on the subscribed topic"""
-        timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-        try:
-            # Try to decode as UTF-8
-            payload = msg.payload.decode('utf-8')
+        # HH:MM:SS.mmm built from time.time() rather than datetime.strftime()
+        now = time.time()
+        lt = time.localtime(now)
+        ms = int((now - int(now)) * 1000)
+        timestamp = f"{lt.tm_hour:02d}:{lt.tm_min:02d}:{lt.tm_sec:02d}.{ms:03d}"
+        # 'replace' never raises, so binary payloads are spotted by the replacement
+        # character instead of a UnicodeDecodeError; plain-ASCII log lines skip that scan
+        payload, _ = codecs.utf_8_decode(msg.payload, 'replace', True)
+        if msg.payload.isascii() or '\ufffd' not in payload:
             print(f"[{timestamp}] 📨 {msg.topic}: {payload}")
-        except UnicodeDecodeError:
+        else:
             # If it's not valid UTF-8, show as hex
             payload_hex = msg.payload.hex()
             print(f"[{timestamp}] 📨 {msg.topic}: [BINARY] {payload_hex}")
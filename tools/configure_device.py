@@ -10,12 +10,36 @@ Usage:
 """
 
 import json
+import os
+import socket
 import sys
-import time
 import argparse
-from typing import Dict, Any, Optional
+import itertools
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, wait
+from typing import Dict, Any, List, Optional, Tuple
 import paho.mqtt.client as mqtt
 
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+
+# Text identifying which command a status reply belongs to, matched
+# case-insensitively against the firmware's OK/ERROR messages
+REPLY_KEYWORDS = {
+    "set_device_name": ("device name",),
+    "set_wifi": ("wifi",),
+    "set_mqtt_server": ("mqtt server",),
+    "set_mqtt_topics": ("topics",),
+    "set_api_endpoints": ("endpoints",),
+    "print_config": ("config printed",),
+    "reset_config": ("reset",),
+}
+
 
 class DeviceConfigurator:
     """Configure ESP32 devices over MQTT"""
@@ -32,16 +56,39 @@ class DeviceConfigurator:
         self.broker = broker
         self.port = port
         self.timeout = timeout
-        self.client = mqtt.Client()
-        self.response_received = False
+        # Per-host/per-process ID with a clean session, so concurrent
+        # configurators never take over each other's session
+        client_id = f"fan_configurator-{socket.gethostname()}-{os.getpid()}"
+        self.client = mqtt.Client(client_id=client_id, clean_session=True,
+                                  transport="tcp")
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self._connected = threading.Event()
+        self._connect_rc = None
+        self._response_event = threading.Event()
         self.last_response = None
 
+        # Only messages on the status topic of the device being configured
+        # count as responses.
+        self._status_topic = None
+        self._subscriptions = set()
+
+        # Commands awaiting a status response, oldest first, keyed by a local
+        # sequence number used only for display. Replies carry no id and the
+        # firmware silently drops malformed commands, so a reply resolves the
+        # oldest pending command whose type it names (see REPLY_KEYWORDS),
+        # falling back to the oldest pending command for generic replies.
+        self._request_ids = itertools.count(1)
+        self._pending: "OrderedDict[int, Tuple[str, Future]]" = OrderedDict()
+        self._pending_lock = threading.Lock()
+
         # Set up callbacks
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
 
     def _on_connect(self, client, userdata, flags, rc):
         """Callback for when the client connects to the broker"""
+        self._connect_rc = rc
+        self._connected.set()
         if rc == 0:
             print(f"✓ Connected to MQTT broker at {self.broker}:{self.port}")
         else:
@@ -49,27 +96,56 @@ class DeviceConfigurator:
 
     def _on_message(self, client, userdata, msg):
         """Callback for when a message is received"""
-        self.response_received = True
+        if msg.topic != self._status_topic:
+            return
+
         self.last_response = msg.payload.decode('utf-8')
-        print(f"  Response: {self.last_response}")
+
+        reply = self.last_response.lower()
+        with self._pending_lock:
+            request_id = next((rid for rid, (cmd, _) in self._pending.items()
+                               if any(k in reply for k in REPLY_KEYWORDS.get(cmd, ()))),
+                              next(iter(self._pending), None))
+            pending = self._pending.pop(request_id) if request_id is not None else None
+
+        if pending:
+            _, future = pending
+            print(f"  Response [{request_id}]: {self.last_response}")
+            future.set_result(self.last_response)
+        else:
+            print(f"  Response: {self.last_response}")
+
+        self._response_event.set()
 
     def connect(self) -> bool:
         """Connect to MQTT broker"""
         try:
             self.client.connect(self.broker, self.port, 60)
             self.client.loop_start()
-            time.sleep(1)  # Give it time to connect
-            return True
+            if not self._connected.wait(self.timeout):
+                print(f"✗ Timed out connecting to broker")
+                return False
+            return self._connect_rc == 0
         except Exception as e:
             print(f"✗ Error connecting to broker: {e}")
             return False
 
     def disconnect(self):
         """Disconnect from MQTT broker"""
-        self.client.loop_stop()
+        # The session is clean, so the broker drops the subscriptions itself
+        self._subscriptions.clear()
+        self._status_topic = None
         self.client.disconnect()
+        self.client.loop_stop()
         print("\n✓ Disconnected from MQTT broker")
 
+    def _subscribe_status(self, status_topic: str):
+        """Subscribe to a device's status topic and make it the active one"""
+        self._status_topic = status_topic
+        if status_topic not in self._subscriptions:
+            self.client.subscribe(status_topic)
+            self._subscriptions.add(status_topic)
+
     def send_command(self, config_topic: str, command: Dict[str, Any],
                     status_topic: Optional[str] = None) -> bool:
         """
@@ -85,10 +161,10 @@ class DeviceConfigurator:
         """
         # Subscribe to status topic if provided
         if status_topic:
-            self.client.subscribe(status_topic)
+            self._subscribe_status(status_topic)
 
         # Reset response flag
-        self.response_received = False
+        self._response_event.clear()
         self.last_response = None
 
         # Send command
@@ -101,16 +177,73 @@ class DeviceConfigurator:
 
         # Wait for response if status topic provided
         if status_topic:
-            start_time = time.time()
-            while not self.response_received and (time.time() - start_time) < self.timeout:
-                time.sleep(0.1)
+            got = self._response_event.wait(self.timeout)
 
-            if not self.response_received:
+            if not got:
                 print(f"  ⚠ No response received (timeout)")
                 return False
 
         return True
 
+    def send_commands(self, config_topic: str, commands: List[Tuple[str, Dict[str, Any]]],
+                      status_topic: str) -> bool:
+        """
+        Publish a batch of configuration commands back-to-back and wait for
+        all of their responses at once
+
+        Commands are published at QoS 1 in one tight loop so the network
+        thread can flush them together; the broker's PUBACKs confirm delivery
+        without any per-command wait.
+
+        Args:
+            config_topic: Topic to send commands to (e.g., "device/fan1/config")
+            commands: List of (description, command dictionary) pairs
+            status_topic: Status topic the device responds on
+
+        Returns:
+            True if every command was sent and answered before the timeout,
+            which is self.timeout per command for the batch as a whole
+        """
+        self._subscribe_status(status_topic)
+
+        success = True
+        futures = []
+        published = []
+        for description, command in commands:
+            request_id = next(self._request_ids)
+            print(f"[{request_id}] {description}")
+
+            future = Future()
+            with self._pending_lock:
+                self._pending[request_id] = (command["cmd"], future)
+
+            cmd_json = json.dumps(command)
+            result = self.client.publish(config_topic, cmd_json, qos=1)
+
+            if result.rc != mqtt.MQTT_ERR_SUCCESS:
+                print(f"  ✗ Failed to send command")
+                with self._pending_lock:
+                    self._pending.pop(request_id, None)
+                success = False
+                continue
+
+            futures.append(future)
+            published.append(result)
+
+        _, not_done = wait(futures, timeout=self.timeout * len(futures))
+
+        with self._pending_lock:
+            self._pending.clear()
+
+        if not_done:
+            unacked = sum(not info.is_published() for info in published)
+            print(f"  ⚠ No response received for {len(not_done)} of {len(futures)} commands (timeout)")
+            if unacked:
+                print(f"  ⚠ Broker did not acknowledge {unacked} of {len(published)} commands")
+            return False
+
+        return success
+
     def configure_device(self, device_name: str, config: Dict[str, Any]) -> bool:
         """
         Configure a device using the provided configuration
@@ -133,85 +266,62 @@ class DeviceConfigurator:
         print(f"Status topic: {status_topic}")
         print(f"{'='*60}\n")
 
-        success = True
+        commands = []
 
         # 1. Set Device Name
         if "device_name" in config:
-            print(f"[1/6] Setting device name to '{config['device_name']}'...")
-            cmd = {
+            commands.append((f"Setting device name to '{config['device_name']}'...", {
                 "cmd": "set_device_name",
                 "name": config["device_name"]
-            }
-            if not self.send_command(config_topic, cmd, status_topic):
-                success = False
-            time.sleep(0.5)
+            }))
 
         # 2. Set WiFi Credentials
         if "wifi_networks" in config:
             for idx, wifi in enumerate(config["wifi_networks"]):
-                print(f"[2/6] Setting WiFi network {idx}: '{wifi['ssid']}'...")
-                cmd = {
+                commands.append((f"Setting WiFi network {idx}: '{wifi['ssid']}'...", {
                     "cmd": "set_wifi",
                     "index": idx,
                     "ssid": wifi["ssid"],
                     "password": wifi["password"]
-                }
-                if not self.send_command(config_topic, cmd, status_topic):
-                    success = False
-                time.sleep(0.5)
+                }))
 
         # 3. Set MQTT Server
         if "mqtt_server" in config:
-            print(f"[3/6] Setting MQTT server to '{config['mqtt_server']}'...")
-            cmd = {
+            commands.append((f"Setting MQTT server to '{config['mqtt_server']}'...", {
                 "cmd": "set_mqtt_server",
                 "server": config["mqtt_server"],
                 "port": config.get("mqtt_port", 1883)
-            }
-            if not self.send_command(config_topic, cmd, status_topic):
-                success = False
-            time.sleep(0.5)
+            }))
 
         # 4. Set MQTT Topics
         if "mqtt_topics" in config:
             topics = config["mqtt_topics"]
-            print(f"[4/6] Setting MQTT topics...")
-            cmd = {
+            commands.append(("Setting MQTT topics...", {
                 "cmd": "set_mqtt_topics",
                 "command": topics["command"],
                 "status": topics["status"]
-            }
-            if not self.send_command(config_topic, cmd, status_topic):
-                success = False
-            time.sleep(0.5)
+            }))
 
         # 5. Set API Endpoints
         if "api_endpoints" in config:
             endpoints = config["api_endpoints"]
-            print(f"[5/6] Setting API endpoints...")
-            cmd = {
+            commands.append(("Setting API endpoints...", {
                 "cmd": "set_api_endpoints",
                 "influxdb": endpoints["influxdb"],
                 "firmware": endpoints["firmware"]
-            }
-            if not self.send_command(config_topic, cmd, status_topic):
-                success = False
-            time.sleep(0.5)
+            }))
 
         # 6. Print Config (verify)
-        print(f"[6/6] Requesting configuration printout...")
-        cmd = {"cmd": "print_config"}
-        if not self.send_command(config_topic, cmd, status_topic):
-            success = False
+        commands.append(("Requesting configuration printout...", {"cmd": "print_config"}))
 
-        return success
+        return self.send_commands(config_topic, commands, status_topic)
 
 
 def load_config(config_file: str) -> Dict[str, Any]:
     """Load configuration from JSON file"""
     try:
-        with open(config_file, 'r') as f:
-            return json.load(f)
+        with open(config_file, 'rb') as f:
+            return _loads(f.read())
     except FileNotFoundError:
         print(f"✗ Configuration file not found: {config_file}")
         sys.exit(1)
@@ -247,7 +357,7 @@ Examples:
                        help='MQTT broker port (default: 1883)')
     parser.add_argument('--device', help='Device name/topic prefix (overrides config file)')
     parser.add_argument('--timeout', type=int, default=5,
-                       help='Response timeout in seconds (default: 5)')
+                       help='Response timeout in seconds per command (default: 5)')
     parser.add_argument('--print-config', action='store_true',
                        help='Only print device configuration (requires --device)')
     parser.add_argument('--reset-config', action='store_true',
@@ -8,37 +8,72 @@ official nvs_partition_gen.py (via esp-idf-nvs-partition-gen Python package).
 
 import argparse
 import csv
+import functools
+import hashlib
 import json
 import os
+import runpy
+import shutil
 import subprocess
 import sys
 import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, List
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+try:
+    import esp_idf_nvs_partition_gen  # noqa: F401
+    HAVE_NVS_GEN = True
+except ImportError:
+    HAVE_NVS_GEN = False
 
 
 DEFAULT_SIZE = 0x5000  # 20KB matches default_16MB.csv
 DEFAULT_OFFSET = 0x9000
 DEFAULT_PORT = "/dev/cu.usbmodem101"
+DEFAULT_BAUD = 921600
+MAX_FLASH_WORKERS = 8
 NAMESPACE = "device_cfg"
 
+# Generated binaries contain WiFi passwords, so they are cached only on request
+# and only in a private per-user directory.
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", "~/.cache")).expanduser() / "fan-controller" / "nvs"
+
+# Characters that force csv.writer to quote a field
+CSV_SPECIAL = set(',"\r\n')
+
 
 def load_config(config_path: Path) -> Dict[str, Any]:
-    with config_path.open() as f:
-        return json.load(f)
+    with config_path.open("rb") as f:
+        return _loads(f.read())
 
 
 def build_csv(config: Dict[str, Any], csv_path: Path):
     """Translate JSON config into Espressif CSV format."""
+    device_name = config.get("device_name")
+    wifi_networks = config.get("wifi_networks") or []
+    mqtt_server = config.get("mqtt_server")
+    topics = config.get("mqtt_topics") or {}
+    endpoints = config.get("api_endpoints") or {}
+    cmd_topic = topics.get("command")
+    stat_topic = topics.get("status")
+    influx = endpoints.get("influxdb")
+    firmware = endpoints.get("firmware")
+
     rows = [["key", "type", "encoding", "value"]]
     rows.append([NAMESPACE, "namespace", "", ""])
 
     # Device name
-    if "device_name" in config:
-        rows.append(["deviceName", "data", "string", config["device_name"]])
+    if device_name is not None:
+        rows.append(["deviceName", "data", "string", device_name])
 
     # WiFi networks
-    wifi_networks = config.get("wifi_networks", [])
     wifi_count = min(len(wifi_networks), 5)
     rows.append(["wifiCount", "data", "u8", wifi_count])
     for idx, net in enumerate(wifi_networks[:5]):
@@ -46,30 +81,33 @@ def build_csv(config: Dict[str, Any], csv_path: Path):
         rows.append([f"wifi{idx}pass", "data", "string", net["password"]])
 
     # MQTT server/port/topics
-    if "mqtt_server" in config:
-        rows.append(["mqttServer", "data", "string", config["mqtt_server"]])
+    if mqtt_server is not None:
+        rows.append(["mqttServer", "data", "string", mqtt_server])
     rows.append(["mqttPort", "data", "u16", config.get("mqtt_port", 1883)])
-    topics = config.get("mqtt_topics", {})
-    if "command" in topics:
-        rows.append(["mqttCmdTopic", "data", "string", topics["command"]])
-    if "status" in topics:
-        rows.append(["mqttStatTopic", "data", "string", topics["status"]])
+    if cmd_topic is not None:
+        rows.append(["mqttCmdTopic", "data", "string", cmd_topic])
+    if stat_topic is not None:
+        rows.append(["mqttStatTopic", "data", "string", stat_topic])
 
     # API endpoints
-    endpoints = config.get("api_endpoints", {})
-    if "influxdb" in endpoints:
-        rows.append(["apiInflux", "data", "string", endpoints["influxdb"]])
-    if "firmware" in endpoints:
-        rows.append(["apiFwUpdate", "data", "string", endpoints["firmware"]])
+    if influx is not None:
+        rows.append(["apiInflux", "data", "string", influx])
+    if firmware is not None:
+        rows.append(["apiFwUpdate", "data", "string", firmware])
 
     # Mark initialized
     rows.append(["initialized", "data", "u8", 1])
 
     with csv_path.open("w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerows(rows)
+        if any(CSV_SPECIAL.intersection(str(row[3])) for row in rows):
+            csv.writer(f).writerows(rows)
+        else:
+            # Nothing needs quoting; same output as csv.writer (which writes
+            # None as an empty field) in a single write
+            f.write("".join(f"{k},{t},{e},{'' if v is None else v}\r\n" for k, t, e, v in rows))
 
 
+@functools.lru_cache(maxsize=1)
 def find_generator() -> str:
     """
     Return a path to nvs_partition_gen.py provided by esp-idf-nvs-partition-gen.
@@ -82,8 +120,7 @@ def find_generator() -> str:
         return str(local)
 
     # Fallback to PATH
-    from shutil import which
-    gen = which("nvs_partition_gen.py")
+    gen = shutil.which("nvs_partition_gen.py")
     if gen:
         return gen
 
@@ -94,20 +131,36 @@ def find_generator() -> str:
 
 
 def generate_binary(csv_path: Path, output_bin: Path, size: int):
+    gen_args = ["generate", str(csv_path), str(output_bin), str(size)]
+
+    if HAVE_NVS_GEN:
+        # Run the package's CLI in this interpreter (what `python -m
+        # esp_idf_nvs_partition_gen` does) instead of spawning a new one.
+        print(f"\nGenerating NVS with official generator (in-process):\n  {' '.join(gen_args)}")
+        saved_argv = sys.argv
+        sys.argv = ["nvs_partition_gen.py"] + gen_args
+        try:
+            runpy.run_module("esp_idf_nvs_partition_gen", run_name="__main__", alter_sys=True)
+        except SystemExit as e:
+            if e.code:
+                raise subprocess.CalledProcessError(e.code, gen_args) from e
+        finally:
+            sys.argv = saved_argv
+        return
+
     gen_script = find_generator()
-    cmd = [
-        sys.executable,
-        gen_script,
-        "generate",
-        str(csv_path),
-        str(output_bin),
-        str(size),
-    ]
+    cmd = [sys.executable, gen_script] + gen_args
     print(f"\nGenerating NVS with official generator:\n  {' '.join(cmd)}")
     subprocess.run(cmd, check=True)
 
 
-def flash_partition(bin_path: Path, port: str, offset: int):
+def flash_partition(bin_path: Path, port: str, offset: int, quiet: bool = False,
+                    baud: int = DEFAULT_BAUD):
+    """
+    Write the NVS binary to the device on `port`. With quiet=True esptool's
+    output is captured (so parallel flashes don't interleave) and only shown
+    if it fails.
+    """
     esptool = Path("~/.platformio/packages/tool-esptoolpy/esptool.py").expanduser()
     if not esptool.exists():
         raise FileNotFoundError(f"esptool.py not found at {esptool}")
@@ -119,12 +172,69 @@ def flash_partition(bin_path: Path, port: str, offset: int):
         "esp32-s3",
         "--port",
         port,
+        "--baud",
+        str(baud),
+        "--before",
+        "default_reset",
+        "--after",
+        "hard_reset",
         "write_flash",
+        "--compress",
         hex(offset),
         str(bin_path),
     ]
-    print(f"\nFlashing NVS partition:\n  {' '.join(cmd)}")
-    subprocess.run(cmd, check=True)
+    print(f"\n[{port}] Flashing NVS partition:\n  {' '.join(cmd)}")
+    if not quiet:
+        subprocess.run(cmd, check=True)
+        return
+
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"\n[{port}] esptool failed:\n{result.stdout}{result.stderr}")
+        result.check_returncode()
+    print(f"[{port}] ✓ Flashed")
+
+
+def flash_all(bin_path: Path, ports: List[str], offset: int, baud: int = DEFAULT_BAUD):
+    """Flash the same binary to every port, running esptool for each in parallel."""
+    if len(ports) == 1:
+        flash_partition(bin_path, ports[0], offset, baud=baud)
+        return
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=min(len(ports), MAX_FLASH_WORKERS)) as ex:
+        futures = {ex.submit(flash_partition, bin_path, port, offset, True, baud): port for port in ports}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except (subprocess.CalledProcessError, OSError) as e:
+                print(f"[{futures[future]}] ✗ {e}")
+                failed.append(futures[future])
+
+    if failed:
+        raise RuntimeError(f"Flashing failed on: {', '.join(sorted(failed))}")
+
+
+def private_cache_dir() -> Path:
+    """Create (if needed) and return the cache directory, refusing one we don't own."""
+    CACHE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+    st = CACHE_DIR.stat()
+    if hasattr(os, "getuid") and st.st_uid != os.getuid():
+        raise PermissionError(f"Cache directory {CACHE_DIR} is not owned by the current user")
+    os.chmod(CACHE_DIR, 0o700)
+    return CACHE_DIR
+
+
+def store_cached(bin_path: Path, cache_path: Path):
+    """Copy bin_path into the cache atomically so concurrent runs never see a partial file."""
+    fd, tmp_name = tempfile.mkstemp(dir=cache_path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as dst, bin_path.open("rb") as src:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp_name, cache_path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
 
 
 def parse_args():
@@ -144,6 +254,11 @@ def parse_args():
         default=DEFAULT_SIZE,
         help="Partition size in bytes (default: 0x5000)",
     )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help=f"Reuse/store binaries generated from identical configs in {CACHE_DIR}",
+    )
     parser.add_argument(
         "--flash",
         action="store_true",
@@ -151,8 +266,15 @@ def parse_args():
     )
     parser.add_argument(
         "--port",
-        default=DEFAULT_PORT,
-        help=f"Serial port for flashing (default: {DEFAULT_PORT})",
+        nargs="+",
+        default=[DEFAULT_PORT],
+        help=f"Serial port(s) for flashing; several ports are flashed in parallel (default: {DEFAULT_PORT})",
+    )
+    parser.add_argument(
+        "--baud",
+        type=int,
+        default=DEFAULT_BAUD,
+        help=f"Serial baud rate for flashing (default: {DEFAULT_BAUD})",
     )
     parser.add_argument(
         "--offset",
@@ -168,12 +290,26 @@ def main():
     config_path = Path(args.config)
     output_bin = Path(args.output)
 
-    config = load_config(config_path)
+    # Identical config + size always produces the same binary, so batch runs
+    # with --cache reuse the first result instead of regenerating it per device.
+    cache_path = None
+    if args.cache:
+        config_hash = hashlib.sha256(config_path.read_bytes()).hexdigest()
+        cache_path = private_cache_dir() / f"nvs_{config_hash}_{args.size:x}.bin"
+
+    if cache_path and cache_path.is_file() and cache_path.stat().st_size == args.size:
+        print(f"\nUsing cached NVS binary: {cache_path}")
+        shutil.copyfile(cache_path, output_bin)
+    else:
+        config = load_config(config_path)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_path = Path(tmpdir) / "nvs_config.csv"
+            build_csv(config, csv_path)
+            generate_binary(csv_path, output_bin, args.size)
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        csv_path = Path(tmpdir) / "nvs_config.csv"
-        build_csv(config, csv_path)
-        generate_binary(csv_path, output_bin, args.size)
+        if cache_path:
+            store_cached(output_bin, cache_path)
 
     print("\n============================================================")
     print("ESP32 NVS Configuration Tool")
@@ -184,8 +320,8 @@ def main():
     print("============================================================")
 
     if args.flash:
-        flash_partition(output_bin, args.port, args.offset)
-        print("\n✓ Successfully flashed NVS partition!\n")
+        flash_all(output_bin, args.port, args.offset, args.baud)
+        print(f"\n✓ Successfully flashed NVS partition to {len(args.port)} device(s)!\n")
 
 
 if __name__ == "__main__":